@@ -1,5 +1,7 @@
+import numpy as np
 import psycopg2
 import requests
+from pgvector.psycopg2 import register_vector
 
 # --------------------------
 # Configuration
@@ -19,30 +21,29 @@ response = requests.post(
 )
 
 response.raise_for_status()
-hello_embedding = response.json()["embedding"]  # full embedding list
+hello_embedding = np.asarray(response.json()["embedding"], dtype=np.float32)
 vector_length = len(hello_embedding)
 print(f"Embedding dimension: {vector_length}")
 
-# Convert to Postgres pgvector ARRAY syntax
-vector_str = "ARRAY[" + ",".join(map(str, hello_embedding)) + "]::vector"
-
 # --------------------------
 # Step 2: Connect to DB
 # --------------------------
 conn = psycopg2.connect(DB_DSN)
+register_vector(conn)  # lets psycopg2 bind the NumPy embedding directly
 cur = conn.cursor()
+cur.execute("SET hnsw.ef_search = 100;")  # pgvector default is 40
 
 # --------------------------
 # Step 3: Run nearest-neighbor query
 # --------------------------
-query = f"""
-SELECT id, text, vector <=> {vector_str} AS distance
+query = """
+SELECT id, text, vector <=> %s::halfvec AS distance
 FROM document_chunk
 ORDER BY distance
-LIMIT {TOP_K};
+LIMIT %s;
 """
 
-cur.execute(query)
+cur.execute(query, (hello_embedding, TOP_K))
 results = cur.fetchall()
 
 # --------------------------
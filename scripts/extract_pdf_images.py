@@ -11,13 +11,22 @@ doc = fitz.open(sys.argv[1])
 out = Path(sys.argv[2])
 out.mkdir(exist_ok=True)
 
-for page_num, page in enumerate(doc, start=1):
-    for img_index, img in enumerate(page.get_images(full=True), start=1):
+# Pages often share the same image (logos, diagram chrome); extract each xref once
+seen = {}  # xref -> saved file name, or None if skipped
+
+for page_num in range(1, doc.page_count + 1):
+    for img_index, img in enumerate(doc.get_page_images(page_num - 1, full=True), start=1):
         xref = img[0]
-        pix = fitz.Pixmap(doc, xref)
-        if pix.n - pix.alpha < 4:  # ignore CMYK
-            img_name = out / f"page{page_num:03d}_img{img_index:02d}.png"
-            pix.save(img_name)
-            rel_path = img_name.name
+        if xref not in seen:
+            pix = fitz.Pixmap(doc, xref)
+            if pix.n - pix.alpha < 4:  # ignore CMYK
+                img_name = out / f"page{page_num:03d}_img{img_index:02d}.png"
+                pix.save(img_name, output="png")
+                seen[xref] = img_name.name
+            else:
+                seen[xref] = None
+            pix = None  # free memory
+
+        rel_path = seen[xref]
+        if rel_path:
             print(f"![Image from page {page_num}]({rel_path} \"Describe this diagram\")")
-        pix = None  # free memory
\ No newline at end of file
@@ -1,18 +1,33 @@
 #!/usr/bin/env python3
 
 import argparse
+import collections
 import concurrent.futures
+import functools
 import hashlib
+import io
 import json
+import mmap
 import os
+import queue
+import re
+import sqlite3
 import sys
+import threading
 import time
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 
+import numpy as np
 import psycopg2
-from psycopg2.extras import execute_batch
+from psycopg2.extras import execute_values
+from pgvector.psycopg2 import register_vector
 from tqdm import tqdm
-import requests
+import httpx
+
+try:
+    import blake3
+except ImportError:  # only needed for --id-hash blake3
+    blake3 = None
 
 # -----------------------------
 # CONFIG
@@ -21,23 +36,65 @@ import requests
 EMBEDDING_DIM = 768
 DEFAULT_CHUNK_SIZE = 800
 DEFAULT_OVERLAP = 120
+# Files at least this large are chunked through mmap
+MMAP_THRESHOLD = 8 * 1024 * 1024
 MAX_WORKERS = min(8, os.cpu_count() or 4)
+# File readers feeding the embedding workers, and how many chunked files may wait
+READ_WORKERS = 4
+READ_QUEUE_SIZE = 32
+# Rows per COPY segment committed by the streaming writer
+COPY_COMMIT_ROWS = 10_000
+# How long Ollama keeps the embedding model loaded after a request
+OLLAMA_KEEP_ALIVE = "1h"
+# Texts per /api/embed request (32 suits CPU, 128 suits CUDA)
+DEFAULT_EMBED_BATCH_SIZE = int(os.environ.get("OLLAMA_EMBED_BATCH_SIZE", 32))
+# HNSW candidate list size per query (pgvector default is 40)
+DEFAULT_EF_SEARCH = 100
+# Ollama model used for --verify summaries
+SUMMARY_MODEL = "llama3.1-rag"
+# Summaries kept for near-duplicate queries in --verify (cosine distance <= 0.02)
+SEMANTIC_CACHE_SIZE = 512
+SEMANTIC_CACHE_MAX_DISTANCE = 0.02
+DEFAULT_EMBEDDING_CACHE_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "rag_processor", "embeddings.sqlite"
+)
+# ~3 KB per 768-dim entry, so about 300 MB on disk at the limit
+DEFAULT_EMBEDDING_CACHE_MAX_ENTRIES = 100_000
+
+SCHEMA_VERSION = 3
 
-SCHEMA_VERSION = 1
+# HNSW build settings. A parallel build needs a shared-memory segment about
+# the size of maintenance_work_mem, so keep it below the container's shm_size
+# (docker-compose.yml sets 1gb; Docker's default is 64MB). Workers = 0 builds
+# serially and needs no shared memory.
+DEFAULT_MAINTENANCE_WORK_MEM = "512MB"
+DEFAULT_MAINTENANCE_WORKERS = 2
+
+# Shared keep-alive pool for all Ollama calls (worker threads reuse connections)
+_HTTP = httpx.Client(
+    transport=httpx.HTTPTransport(retries=3, http2=True),
+    timeout=httpx.Timeout(300.0, connect=10.0),
+    limits=httpx.Limits(max_keepalive_connections=40, max_connections=100, keepalive_expiry=30.0),
+)
 
 # -----------------------------
 # DATABASE MANAGER
 # -----------------------------
 
 class DatabaseManager:
-    def __init__(self, dsn: str):
+    def __init__(self, dsn: str, debug_plan: bool = False):
+        self.dsn = dsn
         self.conn = psycopg2.connect(dsn)
         self.conn.autocommit = False
         self.cursor = self.conn.cursor()
+        self.debug_plan = debug_plan
+        self._search_prepared = False
 
-    def initialize_schema(self):
+    def initialize_schema(self, maintenance_work_mem=DEFAULT_MAINTENANCE_WORK_MEM,
+                          maintenance_workers=DEFAULT_MAINTENANCE_WORKERS):
         # Extensions
         self.cursor.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+        register_vector(self.conn)
 
         # Schema version table
         self.cursor.execute("""
@@ -59,137 +116,616 @@ class DatabaseManager:
         self.cursor.execute(f"""
             CREATE TABLE IF NOT EXISTS document_chunk (
                 id TEXT PRIMARY KEY,
-                vector vector({EMBEDDING_DIM}),
+                vector halfvec({EMBEDDING_DIM}),
                 collection_name TEXT NOT NULL,
                 text TEXT,
                 vmetadata JSONB
             );
         """)
 
-        # Indexes (IVFFlat + HNSW)
+        # Indexes (HNSW only; a second ANN index just doubles write cost)
         self.cursor.execute("""
             CREATE INDEX IF NOT EXISTS idx_document_chunk_collection_name
             ON document_chunk (collection_name);
         """)
 
-        self.cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_document_chunk_vector_ivfflat
-            ON document_chunk
-            USING ivfflat (vector vector_cosine_ops)
-            WITH (lists = 100);
-        """)
+        # Session settings for an HNSW (re)build
+        self.cursor.execute("SET maintenance_work_mem = %s;", (maintenance_work_mem,))
+        self.cursor.execute("SET max_parallel_maintenance_workers = %s;", (maintenance_workers,))
 
         self.cursor.execute("""
             CREATE INDEX IF NOT EXISTS idx_document_chunk_vector_hnsw
             ON document_chunk
-            USING hnsw (vector vector_cosine_ops);
+            USING hnsw (vector halfvec_cosine_ops)
+            WITH (m = 24, ef_construction = 128);
         """)
 
         self.conn.commit()
 
     def _apply_migrations(self, from_version: int):
-        # Placeholder for future migrations
+        if from_version < 2:
+            self._migrate_vector_to_halfvec()
+        if from_version < 3:
+            self._migrate_hnsw_params()
+
         self.cursor.execute(
             "INSERT INTO rag_schema_version (version) VALUES (%s)",
             (SCHEMA_VERSION,)
         )
         self.conn.commit()
 
-    def insert_chunks(self, rows: List[tuple]):
-        sql = """
-            INSERT INTO document_chunk (id, vector, collection_name, text, vmetadata)
-            VALUES (%s, %s, %s, %s, %s)
-            ON CONFLICT (id) DO NOTHING;
-        """
-        execute_batch(self.cursor, sql, rows, page_size=100)
+    def _migrate_vector_to_halfvec(self):
+        # v2: store embeddings as halfvec (2 bytes/dim) instead of vector (4 bytes/dim)
+        self.cursor.execute("""
+            SELECT format_type(atttypid, atttypmod)
+            FROM pg_attribute
+            WHERE attrelid = to_regclass('document_chunk') AND attname = 'vector';
+        """)
+        row = self.cursor.fetchone()
+        if not row or not row[0].startswith("vector"):
+            return  # fresh install or already migrated
+
+        # The old indexes use vector_cosine_ops and cannot survive the type change
+        self.cursor.execute("DROP INDEX IF EXISTS idx_document_chunk_vector_ivfflat;")
+        self.cursor.execute("DROP INDEX IF EXISTS idx_document_chunk_vector_hnsw;")
+        self.cursor.execute(f"""
+            ALTER TABLE document_chunk
+            ALTER COLUMN vector TYPE halfvec({EMBEDDING_DIM})
+            USING vector::halfvec({EMBEDDING_DIM});
+        """)
+
+    def _migrate_hnsw_params(self):
+        # v3: drop the redundant IVFFlat index; HNSW is rebuilt by initialize_schema
+        # with m = 24, ef_construction = 128
+        self.cursor.execute("DROP INDEX IF EXISTS idx_document_chunk_vector_ivfflat;")
+        self.cursor.execute("DROP INDEX IF EXISTS idx_document_chunk_vector_hnsw;")
+
+    def rehash_ids(self, collection: str, algorithm: str) -> int:
+        # Rewrite stored chunk ids with another hash so re-ingest dedup keeps working
+        remap = []
+        with self.conn.cursor(name="rehash_scan") as scan:
+            scan.itersize = 5000
+            scan.execute(
+                "SELECT id, text FROM document_chunk WHERE collection_name = %s;",
+                (collection,)
+            )
+            for old_id, text in scan:
+                new_id = hash_id(collapse_whitespace(text), collection, algorithm)
+                if new_id != old_id:
+                    remap.append((old_id, new_id))
+
+        if remap:
+            self.cursor.execute("""
+                CREATE TEMP TABLE rehash_map (old_id TEXT PRIMARY KEY, new_id TEXT)
+                ON COMMIT DROP;
+            """)
+            execute_values(self.cursor, "INSERT INTO rehash_map VALUES %s", remap, page_size=5000)
+            # A row already stored under its new id makes the old copy redundant
+            self.cursor.execute("""
+                DELETE FROM document_chunk d
+                USING rehash_map m
+                WHERE d.id = m.old_id
+                  AND EXISTS (SELECT 1 FROM document_chunk e WHERE e.id = m.new_id);
+            """)
+            self.cursor.execute("""
+                UPDATE document_chunk d
+                SET id = m.new_id
+                FROM rehash_map m
+                WHERE d.id = m.old_id;
+            """)
         self.conn.commit()
+        return len(remap)
 
-    def similarity_search(self, query_vector, collection, limit=5):
-        # Convert Python list to pgvector literal
-        query_vector_str = f"'[{','.join(map(str, query_vector))}]'::vector"
+    def existing_ids(self, collection: str, ids: List[str]) -> set:
+        if not ids:
+            return set()
+        self.cursor.execute("""
+            SELECT id FROM document_chunk
+            WHERE collection_name = %s AND id = ANY(%s::text[]);
+        """, (collection, ids))
+        found = {chunk_id for chunk_id, in self.cursor.fetchall()}
+        self.conn.commit()
+        return found
 
-        self.cursor.execute(f"""
-            SELECT text, vmetadata, vector <-> {query_vector_str} AS distance
+    def _prepare_similarity_search(self):
+        # Server-side prepared statement: planned once per session, and the
+        # query vector is sent once ($1) instead of twice
+        self.cursor.execute("""
+            PREPARE rag_similarity_search (halfvec, text, integer) AS
+            SELECT text, vmetadata, vector <=> $1 AS distance
             FROM document_chunk
-            WHERE collection_name = %s
-            ORDER BY vector <-> {query_vector_str}
-            LIMIT %s;
-        """, (query_vector, collection, limit))
-        return self.cursor.fetchall()
+            WHERE collection_name = $2
+            ORDER BY vector <=> $1
+            LIMIT $3;
+        """)
+        self._search_prepared = True
+
+    def similarity_search(self, query_vector, collection, limit=5, ef_search=DEFAULT_EF_SEARCH):
+        if not self._search_prepared:
+            self._prepare_similarity_search()
+
+        sql = "EXECUTE rag_similarity_search (%s::halfvec, %s, %s);"
+        params = (np.asarray(query_vector, dtype=np.float32), collection, limit)
+
+        self.cursor.execute("SET LOCAL hnsw.ef_search = %s;", (ef_search,))
+
+        if self.debug_plan:
+            self.cursor.execute("EXPLAIN ANALYZE " + sql, params)
+            print("\n".join(line for line, in self.cursor.fetchall()))
+
+        self.cursor.execute(sql, params)
+        results = self.cursor.fetchall()
+        self.conn.commit()  # end the transaction so SET LOCAL is scoped to this query
+        return results
+
+# -----------------------------
+# STREAMING WRITER
+# -----------------------------
+
+_COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+def _copy_field(value: str) -> str:
+    # Escape a value for COPY ... FORMAT text
+    return value.translate(_COPY_ESCAPES)
+
+@functools.lru_cache(maxsize=None)
+def _vector_format(dim: int) -> str:
+    return "[" + ",".join(["%.6g"] * dim) + "]"
+
+def _vector_text(vector) -> str:
+    # One %-format over a template built once per dimension; faster than
+    # formatting each element separately and joining
+    return _vector_format(len(vector)) % tuple(vector.tolist())
+
+class _CopyStream:
+    """File-like source for copy_expert, fed by ChunkWriter's queue.
+
+    Returns EOF once `limit` rows have been sent or the writer is closed,
+    which ends the current COPY so the rows can be committed.
+    """
+
+    def __init__(self, writer: "ChunkWriter", limit: int):
+        self.writer = writer
+        self.limit = limit
+        self.rows = 0
+        self.buffer = b""
+        self.exhausted = False
+
+    def read(self, size=-1):
+        while not self.exhausted and (size < 0 or len(self.buffer) < size):
+            batch = self.writer._queue.get()
+            if batch is None:
+                self.writer._closed = True
+                self.exhausted = True
+                break
+            self.buffer += "".join(
+                f"{chunk_id}\t{_vector_text(vector)}\t{_copy_field(collection)}\t"
+                f"{_copy_field(text)}\t{_copy_field(metadata)}\n"
+                for chunk_id, vector, collection, text, metadata in batch
+            ).encode("utf-8")
+            self.rows += len(batch)
+            self.exhausted = self.rows >= self.limit
+
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+class ChunkWriter:
+    """Streams embedded rows into document_chunk with COPY on a background thread.
+
+    Rows are copied into a temp staging table and moved with
+    INSERT ... ON CONFLICT DO NOTHING every `commit_every` rows, so memory
+    stays at a few batches and DB writes overlap embedding.
+    """
+
+    def __init__(self, dsn: str, commit_every: int = COPY_COMMIT_ROWS, queue_size: int = MAX_WORKERS * 2):
+        self.conn = psycopg2.connect(dsn)
+        self.commit_every = commit_every
+        self.written = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._closed = False
+        self._aborted = False
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            with self.conn.cursor() as cursor:
+                cursor.execute("""
+                    CREATE TEMP TABLE chunk_staging (LIKE document_chunk)
+                    ON COMMIT DELETE ROWS;
+                """)
+                self.conn.commit()
+
+                while not self._closed:
+                    stream = _CopyStream(self, self.commit_every)
+                    cursor.copy_expert("""
+                        COPY chunk_staging (id, vector, collection_name, text, vmetadata)
+                        FROM STDIN WITH (FORMAT text);
+                    """, stream)
+                    if self._aborted:
+                        self.conn.rollback()
+                        return
+                    cursor.execute("""
+                        INSERT INTO document_chunk (id, vector, collection_name, text, vmetadata)
+                        SELECT id, vector, collection_name, text, vmetadata FROM chunk_staging
+                        ON CONFLICT (id) DO NOTHING;
+                    """)
+                    self.written += cursor.rowcount
+                    self.conn.commit()
+        except Exception as e:
+            self._error = e
+            self.conn.rollback()
+        finally:
+            self.conn.close()
+
+    def _put(self, item):
+        while self._error is None and self._thread.is_alive():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+        if self._error is not None:
+            raise self._error
+
+    def write(self, rows: List[tuple]):
+        if rows:
+            self._put(rows)
+
+    def close(self):
+        self._put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def abort(self):
+        # Discard the uncommitted segment and stop the writer
+        self._aborted = True
+        try:
+            self._put(None)
+        except Exception:
+            pass
+        self._thread.join()
 
 # -----------------------------
 # CHUNKING
 # -----------------------------
 
-def auto_chunk(text: str, target_size=DEFAULT_CHUNK_SIZE, overlap=DEFAULT_OVERLAP):
-    words = text.split()
+_WORD = re.compile(r"\S+")
+# ASCII whitespace as str.split() sees it (bytes \s lacks \x1c-\x1f)
+_WORD_BYTES = re.compile(rb"[^\s\x1c-\x1f]+")
+
+def _word_spans(text):
+    # (start, end) of each whitespace-separated word, splitting bytes the
+    # same way as str so a document chunks identically on either path
+    if isinstance(text, str):
+        for m in _WORD.finditer(text):
+            yield m.span()
+        return
+
+    for m in _WORD_BYTES.finditer(text):
+        word = m.group()
+        if word.isascii():
+            yield m.span()
+            continue
+        # Non-ASCII whitespace (e.g. U+3000) is only visible once decoded;
+        # ASCII bytes never occur inside a multi-byte UTF-8 sequence
+        decoded = word.decode("utf-8")
+        offset, pos = m.start(), 0
+        for sub in _WORD.finditer(decoded):
+            offset += len(decoded[pos:sub.start()].encode())
+            start = offset
+            offset += len(decoded[sub.start():sub.end()].encode())
+            pos = sub.end()
+            yield start, offset
+
+def auto_chunk(text, target_size=DEFAULT_CHUNK_SIZE, overlap=DEFAULT_OVERLAP):
+    # Each chunk is one slice of the original text instead of a re-join of
+    # its words. Accepts str or a bytes-like buffer (e.g. an mmap), in which
+    # case chunks are decoded one at a time.
+    is_bytes = not isinstance(text, str)
+    word_count = sum(1 for _ in _word_spans(text))
+
     # Auto-adjust chunk size for very short or very long documents
-    if len(words) < target_size:
-        target_size = max(50, len(words) // 2)
+    if word_count < target_size:
+        target_size = max(50, word_count // 2)
         overlap = max(10, target_size // 10)
-    elif len(words) > 5000:
+    elif word_count > 5000:
         target_size = min(target_size * 2, 2000)
 
-    chunks = []
+    # Word index of each window's first and last word
+    windows = []
     start = 0
+    while start < word_count:
+        windows.append((start, min(start + target_size, word_count) - 1))
+        start = start + target_size - overlap
+
+    # Second pass records offsets only at window boundaries, so memory is
+    # O(chunks) rather than O(words)
+    first_words = {first for first, _ in windows}
+    last_words = {last for _, last in windows}
+    starts, ends = {}, {}
+    for i, (start, end) in enumerate(_word_spans(text)):
+        if i in first_words:
+            starts[i] = start
+        if i in last_words:
+            ends[i] = end
 
-    while start < len(words):
-        end = start + target_size
-        chunk_words = words[start:end]
-        chunks.append(" ".join(chunk_words))
-        start = end - overlap
+    chunks = []
+    for first, last in windows:
+        chunk = text[starts[first]:ends[last]]
+        chunks.append(chunk.decode("utf-8") if is_bytes else chunk)
 
     return chunks
 
+def chunk_file(path: str):
+    # Large files are scanned through mmap so the whole document never
+    # has to exist as one Python str
+    if os.path.getsize(path) < MMAP_THRESHOLD:
+        with open(path, "r", encoding="utf-8") as f:
+            return auto_chunk(f.read())
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return auto_chunk(mm)
+
+def collapse_whitespace(text: str) -> str:
+    # Chunks keep the source whitespace, but ids and cache keys are computed
+    # over single-space-joined words, the form earlier versions stored, so
+    # re-ingesting an existing folder still matches its rows
+    return " ".join(text.split())
+
 # -----------------------------
 # EMBEDDING
 # -----------------------------
 
+class EmbeddingCache:
+    """Persistent sqlite LRU cache of embeddings keyed by (model, hash(words)).
+
+    Keys are hashed with the same `algorithm` as chunk ids, so switching
+    --id-hash starts the cache cold rather than mixing key formats.
+
+    Holds at most `max_entries` vectors; the least recently used are
+    evicted when a write goes over the limit.
+    """
+
+    # Stay well under sqlite's bound-parameter limit
+    _LOOKUP_PAGE = 500
+
+    def __init__(self, path: str, max_entries: int = DEFAULT_EMBEDDING_CACHE_MAX_ENTRIES,
+                 algorithm: str = "sha1"):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_entries = max(1, max_entries)
+        self.algorithm = algorithm
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, vec BLOB)"
+            )
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(cache)")}
+            if "last_used" not in columns:
+                # Caches written before eviction existed start out equally old
+                self.conn.execute("ALTER TABLE cache ADD COLUMN last_used REAL NOT NULL DEFAULT 0")
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_cache_last_used ON cache (last_used)"
+            )
+            self.conn.commit()
+            self.size = self.conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def _key(self, model: str, words: str) -> str:
+        # `words` is the collapse_whitespace() form of the text
+        return f"{model}:{_hexdigest(words.encode(), self.algorithm)}"
+
+    def get_many(self, model: str, words: List[str]) -> List[Optional[np.ndarray]]:
+        keys = [self._key(model, w) for w in words]
+        found = {}
+        now = time.time()
+        with self.lock:
+            for start in range(0, len(keys), self._LOOKUP_PAGE):
+                page = keys[start:start + self._LOOKUP_PAGE]
+                placeholders = ",".join("?" * len(page))
+                hits = self.conn.execute(
+                    f"SELECT key, vec FROM cache WHERE key IN ({placeholders})", page
+                ).fetchall()
+                found.update(hits)
+                if hits:
+                    self.conn.executemany(
+                        "UPDATE cache SET last_used = ? WHERE key = ?",
+                        [(now, key) for key, _ in hits]
+                    )
+            self.conn.commit()
+        return [
+            np.frombuffer(found[key], dtype=np.float32) if key in found else None
+            for key in keys
+        ]
+
+    def put_many(self, model: str, words: List[str], vectors: np.ndarray):
+        now = time.time()
+        rows = [
+            (self._key(model, w), np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for w, vector in zip(words, vectors)
+        ]
+        with self.lock:
+            before = self.conn.total_changes
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO cache (key, vec, last_used) VALUES (?, ?, ?)", rows
+            )
+            self.size += self.conn.total_changes - before
+
+            if self.size > self.max_entries:
+                self.conn.execute("""
+                    DELETE FROM cache WHERE key IN (
+                        SELECT key FROM cache ORDER BY last_used LIMIT ?
+                    )
+                """, (self.size - self.max_entries,))
+                self.size = self.max_entries
+            self.conn.commit()
+
 class Embedder:
-    def __init__(self, model="nomic-embed-text", base_url="http://localhost:11434"):
+    def __init__(self, model="nomic-embed-text", base_url="http://localhost:11434",
+                 batch_size=DEFAULT_EMBED_BATCH_SIZE, cache: Optional[EmbeddingCache] = None):
         self.model = model
         self.base_url = base_url.rstrip("/")
+        self.batch_size = max(1, batch_size)
+        self._batch_size_lock = threading.Lock()
+        self.cache = cache
+        self.dim = None
+        self.legacy_api = False  # set once /api/embed is found missing
+        self.warm_up()
+
+    def warm_up(self):
+        # Load the model once up front and record its real output dimension
+        try:
+            self.dim = len(self._embed_request(["warmup"])[0])
+        except httpx.HTTPError as e:
+            print(f"Warning: embedding model warmup failed: {e}")
+            return
+        if self.dim != EMBEDDING_DIM:
+            print(f"Warning: {self.model} returns {self.dim}-dim vectors, "
+                  f"but document_chunk stores halfvec({EMBEDDING_DIM})")
 
     def embed(self, texts):
         if isinstance(texts, str):
-            texts = [texts]
+            return self.embed_batch([texts])[0]
+        return self.embed_batch(texts)
 
+    def embed_batch(self, texts, words: Optional[List[str]] = None) -> np.ndarray:
+        # Returns a (len(texts), dim) float32 array. `words` are the texts'
+        # collapse_whitespace() forms, if the caller already has them.
+        if self.cache is None:
+            return self._embed_uncached(texts)
+
+        if words is None:
+            words = [collapse_whitespace(text) for text in texts]
+        # Only send cache misses to Ollama
+        vectors = self.cache.get_many(self.model, words)
+        misses = [i for i, vector in enumerate(vectors) if vector is None]
+        if misses:
+            fresh = self._embed_uncached([texts[i] for i in misses])
+            self.cache.put_many(self.model, [words[i] for i in misses], fresh)
+            for i, vector in zip(misses, fresh):
+                vectors[i] = vector
+        return _stack(vectors)
+
+    def _embed_uncached(self, texts):
+        # Re-read batch_size per slice so a reduction applies immediately
+        parts = []
+        start = 0
+        while start < len(texts):
+            size = self.batch_size
+            parts.append(self._embed_adaptive(texts[start:start + size]))
+            start += size
+        return _stack(parts)
+
+    def _embed_adaptive(self, texts):
+        try:
+            return self._embed_request(texts)
+        except (httpx.HTTPStatusError, httpx.TimeoutException) as e:
+            # Only size-related failures (read/write timeouts, 413, server
+            # errors) can be helped by a smaller batch
+            if len(texts) <= 1 or not _batch_too_large(e):
+                raise
+            # Halve the batch and retry, down to single texts
+            mid = len(texts) // 2
+            vectors = np.concatenate([self._embed_adaptive(texts[:mid]), self._embed_adaptive(texts[mid:])])
+            # Keep the size that worked for the rest of the run, so later
+            # batches don't each wait out a timeout before splitting
+            with self._batch_size_lock:
+                self.batch_size = min(self.batch_size, len(texts) - mid)
+            return vectors
+
+    def _embed_request(self, texts):
+        if self.legacy_api:
+            return self._embed_sequential(texts)
+
+        # One request per batch via /api/embed instead of one per text
+        r = _HTTP.post(
+            f"{self.base_url}/api/embed",
+            json={
+                "model": self.model,
+                "input": texts,
+                "keep_alive": OLLAMA_KEEP_ALIVE
+            },
+            timeout=60
+        )
+        if r.status_code == 404:
+            # Older Ollama without /api/embed. A missing model is also a 404
+            # and fails again on the legacy endpoint with its own error.
+            vectors = self._embed_sequential(texts)
+            self.legacy_api = True
+            return vectors
+        r.raise_for_status()
+        data = r.json()
+        if "embeddings" not in data:
+            # Older Ollama without batch support
+            return self._embed_sequential(texts)
+        return np.asarray(data["embeddings"], dtype=np.float32)
+
+    def _embed_sequential(self, texts):
         vectors = []
         for text in texts:
-            r = requests.post(
+            r = _HTTP.post(
                 f"{self.base_url}/api/embeddings",
                 json={
                     "model": self.model,
-                    "prompt": text
+                    "prompt": text,
+                    "keep_alive": OLLAMA_KEEP_ALIVE
                 },
                 timeout=60
             )
             r.raise_for_status()
             vectors.append(r.json()["embedding"])
-        return vectors
+        return np.asarray(vectors, dtype=np.float32)
 
-    def embed_batch(self, texts):
-        # same as embed, kept for compatibility
-        return self.embed(texts)
+def _batch_too_large(error: httpx.HTTPError) -> bool:
+    # Connect and pool timeouts mean Ollama is unreachable, not overloaded
+    if isinstance(error, (httpx.ReadTimeout, httpx.WriteTimeout)):
+        return True
+    if isinstance(error, httpx.TimeoutException):
+        return False
+    status = error.response.status_code
+    return status == 413 or status >= 500
+
+def _stack(arrays) -> np.ndarray:
+    # Row-stack vectors or batches of vectors into one float32 matrix
+    if not arrays:
+        return np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+    return np.vstack(arrays).astype(np.float32, copy=False)
 
 # -----------------------------
 # INGESTION
 # -----------------------------
 
-def hash_id(text: str, collection: str):
-    return hashlib.sha1(f"{collection}:{text}".encode()).hexdigest()
+def _hexdigest(data: bytes, algorithm: str = "sha1"):
+    if algorithm == "blake3":
+        # Same 40-char width as SHA-1, several times faster
+        return blake3.blake3(data).hexdigest()[:40]
+    return hashlib.sha1(data).hexdigest()
+
+def hash_id(words: str, collection: str, algorithm: str = "sha1"):
+    # `words` is the collapse_whitespace() form of the chunk
+    return _hexdigest(f"{collection}:{words}".encode(), algorithm)
 
-def process_file(embedder: Embedder, chunks: List[str], file: str, collection: str):
-    vectors = embedder.embed(chunks)
+def process_batch(embedder: Embedder, batch: List[Tuple[str, int, str, str, str]], collection: str, base_folder: str):
+    vectors = embedder.embed_batch(
+        [chunk for _, _, chunk, _, _ in batch],
+        [words for _, _, _, words, _ in batch]
+    )
     rows = []
 
-    # Derive product from folder structure
-    rel_path = os.path.relpath(file, base_folder)  # relative to base folder
-    product = rel_path.split(os.sep)[0]  # first folder = product
+    for (file, _, chunk, _, chunk_id), vector in zip(batch, vectors):
+        # Derive product from folder structure
+        rel_path = os.path.relpath(file, base_folder)  # relative to base folder
+        product = rel_path.split(os.sep)[0]  # first folder = product
 
-    for chunk, vector in zip(chunks, vectors):
         rows.append((
-            hash_id(chunk, collection),
+            chunk_id,
             vector,
             collection,
             chunk,
@@ -200,7 +736,32 @@ def process_file(embedder: Embedder, chunks: List[str], file: str, collection: s
         ))
     return rows
 
-def ingest_folder(db: DatabaseManager, embedder: Embedder, folder: str, collection: str):
+def _read_files(files: List[str], chunk_queue: queue.Queue, stop: threading.Event):
+    # Producer: read + chunk files on a small pool and hand (file, chunks)
+    # to the embedding side; the bounded queue caps how far reads run ahead
+    def put(item):
+        while not stop.is_set():
+            try:
+                chunk_queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def read(file):
+        try:
+            put((file, chunk_file(file)))
+        except Exception as e:
+            put((file, e))
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=READ_WORKERS) as readers:
+            for file in files:
+                readers.submit(read, file)
+    finally:
+        put(None)
+
+def ingest_folder(db: DatabaseManager, embedder: Embedder, folder: str, collection: str,
+                  id_hash: str = "sha1"):
     files = [
         os.path.join(root, f)
         for root, _, filenames in os.walk(folder)
@@ -208,36 +769,146 @@ def ingest_folder(db: DatabaseManager, embedder: Embedder, folder: str, collecti
         if f.lower().endswith((".txt", ".md"))
     ]
 
-    rows = []
+    chunk_queue = queue.Queue(maxsize=READ_QUEUE_SIZE)
+    stop = threading.Event()
+    producer = threading.Thread(target=_read_files, args=(files, chunk_queue, stop), daemon=True)
+    producer.start()
 
-    with concurrent.futures.ThreadPoolExecutor(MAX_WORKERS) as executor:
-        futures = []
+    writer = ChunkWriter(db.dsn)
+    in_flight = collections.deque()
+    seen_ids = set()
+    skipped = 0
 
-        for file in files:
-            with open(file, "r", encoding="utf-8") as f:
-                text = f.read()
+    def collect(return_when):
+        done, _ = concurrent.futures.wait(in_flight, return_when=return_when)
+        for future in done:
+            in_flight.remove(future)
+            batch_rows = future.result()
+            writer.write(batch_rows)
+            progress.update(len(batch_rows))
 
-            chunks = auto_chunk(text)
+    # Batch-level parallelism: chunks from all files are pooled into
+    # fixed-size batches while the producer is still reading
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor, \
+            tqdm(total=0, unit="chunk") as progress:
+        try:
+            batch = []
+            while True:
+                item = chunk_queue.get()
+                if item is None:
+                    break
 
-            futures.append(
-                executor.submit(process_file, embedder, chunks, file, collection, folder)
-            )
+                file, chunks = item
+                if isinstance(chunks, Exception):
+                    raise chunks
+
+                # Drop duplicates within this run and chunks already stored,
+                # before they cost an embedding call
+                pending = {}
+                for idx, chunk in enumerate(chunks):
+                    # Collapsed once here and reused for the cache key
+                    words = collapse_whitespace(chunk)
+                    chunk_id = hash_id(words, collection, id_hash)
+                    if chunk_id not in seen_ids and chunk_id not in pending:
+                        pending[chunk_id] = (idx, chunk, words)
+                seen_ids.update(pending)
+                for chunk_id in db.existing_ids(collection, list(pending)):
+                    del pending[chunk_id]
+
+                skipped += len(chunks) - len(pending)
+                progress.total += len(pending)
+                progress.set_postfix(skipped=skipped)
 
-        for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures)):
-            rows.extend(future.result())
+                for chunk_id, (idx, chunk, words) in pending.items():
+                    batch.append((file, idx, chunk, words, chunk_id))
+                    if len(batch) < embedder.batch_size:
+                        continue
 
-    db.insert_chunks(rows)
+                    in_flight.append(executor.submit(process_batch, embedder, batch, collection, folder))
+                    batch = []
+                    # Bound memory: keep at most two batches queued per worker
+                    while len(in_flight) >= MAX_WORKERS * 2:
+                        collect(concurrent.futures.FIRST_COMPLETED)
+
+            if batch:
+                in_flight.append(executor.submit(process_batch, embedder, batch, collection, folder))
+            if in_flight:
+                collect(concurrent.futures.ALL_COMPLETED)
+        except BaseException:
+            writer.abort()
+            raise
+        finally:
+            stop.set()
+
+    writer.close()
+    print(f"Inserted {writer.written} new chunks into {collection} ({skipped} skipped)")
 
 # -----------------------------
 # VERIFY CLI WITH SUMMARY
 # -----------------------------
-import requests
+
+class SemanticCache:
+    """LRU cache of query results matched by embedding cosine similarity.
+
+    A lookup is one matrix-vector product over the normalized cached
+    query vectors, so near-identical questions skip search and the LLM.
+    """
+
+    def __init__(self, capacity=SEMANTIC_CACHE_SIZE, max_distance=SEMANTIC_CACHE_MAX_DISTANCE):
+        self.capacity = capacity
+        self.min_similarity = 1.0 - max_distance
+        self.matrix = None  # (capacity, dim) L2-normalized query vectors
+        self.results = []
+        self.last_used = np.zeros(capacity, dtype=np.int64)
+        self.clock = 0
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, vector):
+        if not self.results:
+            return None
+        similarities = self.matrix[:len(self.results)] @ self._normalize(vector)
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.min_similarity:
+            return None
+        self.clock += 1
+        self.last_used[best] = self.clock
+        return self.results[best]
+
+    def put(self, vector, result):
+        vector = self._normalize(vector)
+        if self.matrix is None:
+            self.matrix = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+
+        if len(self.results) < self.capacity:
+            slot = len(self.results)
+            self.results.append(result)
+        else:
+            slot = int(np.argmin(self.last_used))  # evict least recently used
+            self.results[slot] = result
+
+        self.matrix[slot] = vector
+        self.clock += 1
+        self.last_used[slot] = self.clock
 
 def verify_rag(db: DatabaseManager, embedder: Embedder, collection: str, top_k=5):
     """
     Interactive query tool: retrieves top matching chunks from DB
     and asks Ollama to generate a concise executive summary.
     """
+    # Repeated queries in a session skip the embedding call entirely
+    @functools.lru_cache(maxsize=1024)
+    def embed_query(query: str):
+        vector = embedder.embed(query)
+        vector.setflags(write=False)  # shared by every cache hit
+        return vector
+
+    summaries = SemanticCache()
+
     print("\nEnter a query (Ctrl+C to exit):\n")
     while True:
         query = input("> ").strip()
@@ -245,7 +916,14 @@ def verify_rag(db: DatabaseManager, embedder: Embedder, collection: str, top_k=5
             continue
 
         # Step 1: Embed the query
-        vector = embedder.embed([query])[0]  # returns a list
+        vector = embed_query(query)
+
+        cached = summaries.get(vector)
+        if cached is not None:
+            print("\n--- EXECUTIVE SUMMARY (cached) ---\n")
+            print(cached)
+            print("\n-------------------------\n")
+            continue
 
         # Step 2: Retrieve top chunks
         results = db.similarity_search(vector, collection, limit=top_k)
@@ -254,34 +932,50 @@ def verify_rag(db: DatabaseManager, embedder: Embedder, collection: str, top_k=5
             print("No relevant documents found.\n")
             continue
 
-        # Step 3: Concatenate retrieved text
-        top_chunks = [text for text, meta, dist in results]
-        combined_text = "\n\n".join(top_chunks)
-
-        # Step 4: Generate summary using Ollama
-        prompt = (
-            f"Provide a concise, readable executive summary of the following documents "
-            f"(retain key details, ignore links and headers):\n\n{combined_text}"
+        # Step 3: Build the prompt in one buffer from the retrieved text
+        prompt = io.StringIO()
+        prompt.write(
+            "Provide a concise, readable executive summary of the following documents "
+            "(retain key details, ignore links and headers):\n\n"
         )
+        for i, (text, meta, dist) in enumerate(results):
+            if i:
+                prompt.write("\n\n")
+            prompt.write(text)
 
+        # Step 4: Stream the summary from Ollama, printing tokens as they arrive
+        print("\n--- EXECUTIVE SUMMARY ---\n")
+        parts = []
         try:
-            r = requests.post(
-                "http://localhost:11434/api/completions",
+            with _HTTP.stream(
+                "POST",
+                f"{embedder.base_url}/api/generate",
                 json={
-                    "model": "llama3.1-rag",
-                    "prompt": prompt,
-                    "temperature": 0.3,
-                    "max_tokens": 500
+                    "model": SUMMARY_MODEL,
+                    "prompt": prompt.getvalue(),
+                    "stream": True,
+                    "options": {
+                        "temperature": 0.3,
+                        "num_predict": 500
+                    }
                 },
                 timeout=120
-            )
-            r.raise_for_status()
-            summary = r.json()["completion"].strip()
-            print("\n--- EXECUTIVE SUMMARY ---\n")
-            print(summary)
-            print("\n-------------------------\n")
-        except requests.RequestException as e:
-            print(f"Error generating summary: {e}\n")
+            ) as r:
+                r.raise_for_status()
+                for line in r.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if "error" in chunk:
+                        raise RuntimeError(chunk["error"])
+                    parts.append(chunk.get("response", ""))
+                    print(parts[-1], end="", flush=True)
+                    if chunk.get("done"):
+                        break
+            print("\n\n-------------------------\n")
+            summaries.put(vector, "".join(parts).strip())
+        except (httpx.HTTPError, RuntimeError) as e:
+            print(f"\nError generating summary: {e}\n")
 
 # -----------------------------
 # MAIN
@@ -294,18 +988,45 @@ def main():
     parser.add_argument("--collection", required=True)
     parser.add_argument("--version", default="v1")
     parser.add_argument("--verify", action="store_true")
+    parser.add_argument("--debug-plan", action="store_true",
+                        help="Print EXPLAIN ANALYZE for each --verify search")
+    parser.add_argument("--embed-batch-size", type=int, default=DEFAULT_EMBED_BATCH_SIZE,
+                        help="Texts per Ollama embedding request (env: OLLAMA_EMBED_BATCH_SIZE)")
+    parser.add_argument("--embedding-cache-path", default=DEFAULT_EMBEDDING_CACHE_PATH,
+                        help="sqlite file caching embeddings across runs (empty string disables)")
+    parser.add_argument("--embedding-cache-max-entries", type=int, default=DEFAULT_EMBEDDING_CACHE_MAX_ENTRIES,
+                        help="Least recently used embeddings are evicted beyond this many")
+    parser.add_argument("--maintenance-work-mem", default=DEFAULT_MAINTENANCE_WORK_MEM,
+                        help="maintenance_work_mem for HNSW index builds (keep below the DB container's shm_size)")
+    parser.add_argument("--maintenance-workers", type=int, default=DEFAULT_MAINTENANCE_WORKERS,
+                        help="Parallel workers for HNSW index builds (0 = serial, no shared memory)")
+    parser.add_argument("--id-hash", choices=["sha1", "blake3"], default="sha1",
+                        help="Hash used for chunk ids (blake3 needs 'pip install blake3')")
+    parser.add_argument("--rehash", action="store_true",
+                        help="Rewrite the collection's existing chunk ids with --id-hash")
 
     args = parser.parse_args()
 
+    if args.id_hash == "blake3" and blake3 is None:
+        parser.error("--id-hash blake3 requires the blake3 package (pip install blake3)")
+
     collection = f"{args.collection}@{args.version}"
 
-    db = DatabaseManager(args.dsn)
-    db.initialize_schema()
+    db = DatabaseManager(args.dsn, debug_plan=args.debug_plan)
+    db.initialize_schema(args.maintenance_work_mem, args.maintenance_workers)
+
+    cache = (
+        EmbeddingCache(args.embedding_cache_path, args.embedding_cache_max_entries, args.id_hash)
+        if args.embedding_cache_path else None
+    )
+    embedder = Embedder(batch_size=args.embed_batch_size, cache=cache)
 
-    embedder = Embedder()
+    if args.rehash:
+        count = db.rehash_ids(collection, args.id_hash)
+        print(f"Rehashed {count} chunk ids in {collection} with {args.id_hash}")
 
     if args.folder:
-        ingest_folder(db, embedder, args.folder, collection)
+        ingest_folder(db, embedder, args.folder, collection, id_hash=args.id_hash)
 
     if args.verify:
         verify_rag(db, embedder, collection)